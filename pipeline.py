@@ -2,18 +2,30 @@
 # Scarica un database SQLite pubblico da Google Drive e esporta TUTTE le tabelle in CSV (separatore ';')
 # Salva i CSV in ./output/ (con manifest.json). Pulisce l'output a ogni run se CLEAN_OUTPUT=1.
 
-import os, glob, json, hashlib, sqlite3, sys, traceback
+import os, io, glob, json, hashlib, sqlite3, sys, traceback, threading, queue, shutil, subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 import pandas as pd
 
+try:
+    import orjson  # serializzazione JSON in Rust; opzionale
+except ImportError:
+    orjson = None
+
+_ROME = ZoneInfo("Europe/Rome")  # costruito una volta: evita il lookup tzdata per chiamata
+
 # =========== CONFIG ===========
 SRC_FOLDER_ID     = os.getenv("SRC_FOLDER_ID", "1vsVUoDGDGeVItdzkmWGZf5l0rA4gjfN4")  # cartella NUOVA
 SRC_FILE_ID       = os.getenv("SRC_FILE_ID",   "")  # opzionale: ID file diretto (es. 1D0eURKnVOJAlTvHGjUDbMqcUN4_CRr2F)
 TARGET_FILENAME   = os.getenv("TARGET_FILENAME", "data_raw.sqlite3")
 
 CSV_SEPARATOR     = os.getenv("CSV_SEPARATOR", ";")
+CSV_ENGINE        = os.getenv("CSV_ENGINE", "auto")  # auto | duckdb | polars | arrow | cli | pandas
+HASH_ALGO         = os.getenv("HASH_ALGO", "md5")    # md5 | sha256 (SHA-NI via OpenSSL) | xxh3 (richiede xxhash)
+CSV_COMPRESSION   = os.getenv("CSV_COMPRESSION", "") # "" (nessuna) | zstd (richiede zstandard)
 SQLITE_CHUNKSIZE  = int(os.getenv("SQLITE_CHUNKSIZE", "250000"))
+PARTITION_ROWS    = int(os.getenv("PARTITION_ROWS", "1000000"))  # soglia per l'export partizionato per rowid
 CLEAN_OUTPUT      = os.getenv("CLEAN_OUTPUT", "1") == "1"
 
 # override orario (2 modalità): run manuale Actions o variabile esplicita
@@ -23,43 +35,117 @@ FORCE_RUN         = os.getenv("FORCE_RUN", "0") == "1"
 WORKDIR     = os.getenv("WORKDIR", ".")
 DOWNLOADDIR = os.path.join(WORKDIR, "tmp_download")
 OUTPUTDIR   = os.path.join(WORKDIR, "output")
-os.makedirs(DOWNLOADDIR, exist_ok=True)
-os.makedirs(OUTPUTDIR,   exist_ok=True)
+# (le directory vengono create in main()/download: l'import del modulo non ha effetti collaterali)
 # =================================
 
 def log(msg): print(f"[pipeline] {msg}", flush=True)
 
-def md5sum(path: str) -> str:
-    h = hashlib.md5()
+def _json_dumps(obj, indent: bool = False) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode()
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None)
+
+def _new_hasher(algo: str = None):
+    algo = algo or HASH_ALGO
+    if algo == "xxh3":
+        import xxhash
+        return xxhash.xxh3_64()
+    return hashlib.new(algo)
+
+def hash_file(path: str, algo: str = None) -> str:
+    # file_digest cicla in C sul buffer interno, niente dispatch Python per chunk
+    algo = algo or HASH_ALGO
     with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(1 << 20), b""): h.update(chunk)
-    return h.hexdigest()
+        if algo == "xxh3":
+            h = _new_hasher(algo)
+            for chunk in iter(lambda: f.read(1 << 20), b""): h.update(chunk)
+            return h.hexdigest()
+        return hashlib.file_digest(f, algo).hexdigest()
+
+class _SafeTable(dict):
+    # codepoint oltre la tabella precalcolata: stessa regola, memoizzata al volo
+    def __missing__(self, i):
+        r = chr(i) if chr(i).isalnum() else "_"
+        self[i] = r
+        return r
+
+_SAFE_TABLE = _SafeTable({i: (c if c.isalnum() or c in "-._" else "_") for i in range(128) for c in [chr(i)]})
 
 def safe_name(s: str) -> str:
-    return "".join(c if c.isalnum() or c in "-._" else "_" for c in s)
+    # str.translate scorre l'intera stringa in C, nessuna allocazione per carattere
+    return s.translate(_SAFE_TABLE)
 
 def clean_output_dir(out_dir: str):
     removed = 0
-    for p in glob.glob(os.path.join(out_dir, "*")):
-        try: os.remove(p); removed += 1
-        except Exception: pass
+    with os.scandir(out_dir) as it:
+        for e in it:
+            try: os.unlink(e.path); removed += 1
+            except Exception: pass
     if removed: log(f"Output pulito: rimossi {removed} file.")
 
+def _find_target(root: str, name: str):
+    # Walk iterativo con os.scandir: niente lista di tutti i path come glob(**)
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        with os.scandir(d) as it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False): stack.append(e.path)
+                elif e.name == name and e.is_file(): yield e.path
+
 def _within_window_europe_rome(now=None):
-    if now is None: now = datetime.now(ZoneInfo("Europe/Rome"))
+    if now is None: now = datetime.now(_ROME)
     h = now.hour
     return (15 <= h <= 23) or (0 <= h <= 2)
 
+_SRC_HASH = None  # hash del DB sorgente, calcolato in streaming durante il download
+
+def _download_streaming(file_id: str, out: str) -> str:
+    # Scarica con requests in streaming e calcola l'hash nello stesso passaggio:
+    # il file non viene riletto da disco per l'hash della sorgente
+    import requests
+    from gdown.download import get_url_from_gdrive_confirmation
+    global _SRC_HASH
+    url = f"https://drive.google.com/uc?id={file_id}"
+    with requests.Session() as s:
+        r = s.get(url, stream=True)
+        r.raise_for_status()
+        if "text/html" in r.headers.get("Content-Type", ""):
+            url = get_url_from_gdrive_confirmation(r.text)
+            r = s.get(url, stream=True)
+            r.raise_for_status()
+        h = _new_hasher()
+        with open(out, "wb") as f:
+            written = flushed = 0
+            for b in r.iter_content(chunk_size=1 << 20):
+                f.write(b); h.update(b)
+                written += len(b)
+                if written - flushed >= (64 << 20):
+                    # avvia il writeback e scarta le pagine già scritte: così il
+                    # disco lavora in parallelo alla rete invece che al flush finale
+                    f.flush()
+                    if hasattr(os, "posix_fadvise"):
+                        os.posix_fadvise(f.fileno(), 0, written, os.POSIX_FADV_DONTNEED)
+                    flushed = written
+    _SRC_HASH = h.hexdigest()
+    return out
+
 def download_sqlite_from_drive() -> str:
     import gdown
     log(f"gdown version: {getattr(gdown, '__version__', 'unknown')}")
     log(f"Parametri: SRC_FILE_ID='{SRC_FILE_ID}', SRC_FOLDER_ID='{SRC_FOLDER_ID}', TARGET_FILENAME='{TARGET_FILENAME}'")
 
+    os.makedirs(DOWNLOADDIR, exist_ok=True)
+
     # 1) Prova con ID file (se presente)
     if SRC_FILE_ID:
         out = os.path.join(DOWNLOADDIR, "source_by_id.sqlite3")
         log(f"Tento download diretto da file id: {SRC_FILE_ID}")
-        gdown.download(id=SRC_FILE_ID, output=out, quiet=False, fuzzy=True)
+        try:
+            _download_streaming(SRC_FILE_ID, out)
+        except Exception as e:
+            log(f"Download streaming fallito ({e}); fallback su gdown.")
+            gdown.download(id=SRC_FILE_ID, output=out, quiet=False, fuzzy=True)
         if os.path.exists(out) and os.path.getsize(out) > 0:
             log(f"OK: scaricato per ID → {out} ({os.path.getsize(out)} bytes)")
             return out
@@ -69,8 +155,7 @@ def download_sqlite_from_drive() -> str:
     # 2) Fallback: scarica la CARTELLA e cerca per NOME
     log(f"Scarico la cartella id={SRC_FOLDER_ID} (può richiedere qualche secondo)...")
     gdown.download_folder(id=SRC_FOLDER_ID, output=DOWNLOADDIR, quiet=False, use_cookies=False)
-    candidates = [p for p in glob.glob(os.path.join(DOWNLOADDIR, "**", "*"), recursive=True)
-                  if os.path.basename(p) == TARGET_FILENAME and os.path.isfile(p)]
+    candidates = list(_find_target(DOWNLOADDIR, TARGET_FILENAME))
     log(f"Candidati trovati per nome '{TARGET_FILENAME}': {len(candidates)}")
     for c in candidates[:5]:
         log(f"  - {c} ({os.path.getsize(c)} bytes)")
@@ -82,47 +167,301 @@ def download_sqlite_from_drive() -> str:
     log(f"Selezionato: {best}")
     return best
 
+class _HashingWriter:
+    # Tee dei buffer in uscita verso l'hash, così il CSV non viene riletto da disco
+    closed = False
+    def __init__(self, f, h): self.f, self.h = f, h
+    def write(self, b):
+        self.h.update(b.encode("utf-8") if isinstance(b, str) else b)
+        return self.f.write(b)
+    def flush(self): self.f.flush()
+    def close(self): pass  # il file sottostante è chiuso dal chiamante
+    def writable(self): return True
+    def readable(self): return False
+    def seekable(self): return False
+
+def _sq(s: str) -> str:
+    # escape per literal SQL tra apici singoli
+    return s.replace("'", "''")
+
+def _fadvise_path(path: str, advice: str):
+    # Hint al kernel sul pattern di accesso al file; no-op dove posix_fadvise manca
+    adv = getattr(os, advice, None)
+    if adv is None or not hasattr(os, "posix_fadvise"): return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try: os.posix_fadvise(fd, 0, 0, adv)
+        finally: os.close(fd)
+    except OSError:
+        pass
+
+def _connect_ro(db_path: str, check_same_thread: bool = True) -> sqlite3.Connection:
+    # Connessione read-only immutable con PRAGMA tarati per scansioni sequenziali
+    con = sqlite3.connect(f"file:{db_path}?mode=ro&immutable=1", uri=True, check_same_thread=check_same_thread)
+    con.execute("PRAGMA mmap_size=30000000000")   # mmap del DB invece di read() pagina per pagina
+    con.execute("PRAGMA cache_size=-262144")      # 256 MiB di page cache
+    con.execute("PRAGMA temp_store=MEMORY")
+    con.execute("PRAGMA query_only=1")
+    return con
+
+def _export_table_duckdb(db_path: str, t: str, out_csv: str, sep: str) -> int:
+    # Streaming colonnare SQLite -> CSV interamente in C++ (niente oggetti Python per cella)
+    import duckdb
+    con = duckdb.connect()
+    try:
+        con.execute("INSTALL sqlite; LOAD sqlite;")
+        res = con.execute(
+            f"COPY (SELECT * FROM sqlite_scan('{_sq(db_path)}', '{_sq(t)}')) "
+            f"TO '{_sq(out_csv)}' (HEADER, DELIMITER '{_sq(sep)}')"
+        ).fetchone()
+        return int(res[0]), None  # duckdb scrive da sé: hash calcolato a valle
+    finally:
+        con.close()
+
+def _export_table_cli(con, db_path: str, t: str, out_csv: str, sep: str, nrows: int = None):
+    # Writer CSV in C della shell sqlite3: evita del tutto pandas e l'heap Python
+    if not shutil.which("sqlite3"):
+        raise FileNotFoundError("sqlite3 CLI non presente nel PATH")
+    tq = t.replace('"', '""')
+    cmd = (f'.headers on\n.mode csv\n.separator "{sep}"\n'
+           f'.output "{out_csv}"\nSELECT * FROM "{tq}";\n.output stdout\n')
+    subprocess.run(["sqlite3", "-readonly", db_path], input=cmd.encode(),
+                   check=True, capture_output=True)
+    rows = nrows if nrows is not None else con.execute(f"SELECT COUNT(*) FROM '{t}'").fetchone()[0]
+    return rows, None
+
+def _export_table_polars(con, t: str, out_csv: str, sep: str, chunksize: int) -> int:
+    # Formatter CSV in Rust su batch colonnari; il file viene aperto una volta sola
+    import polars as pl
+    rows_total, first, h = 0, True, _new_hasher()
+    with open(out_csv, "wb") as f:
+        w = _HashingWriter(f, h)
+        for df in pl.read_database(f"SELECT * FROM '{t}'", con, iter_batches=True, batch_size=chunksize):
+            rows_total += df.height
+            df.write_csv(w, separator=sep, include_header=first)
+            first = False
+    return rows_total, h.hexdigest()
+
+def _export_table_arrow(con, t: str, out_csv: str, sep: str, chunksize: int):
+    # Encoding CSV multi-thread in C++ su batch colonnari Arrow
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    rows_total, writer, h = 0, None, _new_hasher()
+    with open(out_csv, "wb") as f:
+        sink = _HashingWriter(f, h)
+        try:
+            for chunk in pd.read_sql_query(f"SELECT * FROM '{t}'", con, chunksize=chunksize):
+                rows_total += len(chunk)
+                tbl = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pacsv.CSVWriter(sink, tbl.schema,
+                                             write_options=pacsv.WriteOptions(delimiter=sep))
+                writer.write_table(tbl)
+        finally:
+            if writer is not None: writer.close()
+    return rows_total, h.hexdigest()
+
+def _write_chunks(chunks, out_csv: str, sep: str):
+    first, rows_total, h = True, 0, _new_hasher()
+
+    def _drain(sink):
+        nonlocal first, rows_total
+        for chunk in chunks:
+            rows_total += len(chunk)
+            chunk.to_csv(sink, index=False, sep=sep, header=first)
+            first = False
+
+    if CSV_COMPRESSION == "zstd":
+        # meno byte verso il disco: comprime in streaming, hash sull'artefatto .zst
+        import zstandard
+        with open(out_csv, "wb") as raw:
+            w = _HashingWriter(raw, h)
+            with zstandard.ZstdCompressor(level=3, threads=-1).stream_writer(w, closefd=False) as zw:
+                tw = io.TextIOWrapper(zw, encoding="utf-8", newline="")
+                _drain(tw)
+                tw.flush(); tw.detach()
+    else:
+        with open(out_csv, "w", encoding="utf-8", newline="") as f:
+            _drain(_HashingWriter(f, h))
+    return rows_total, h.hexdigest()
+
+def _export_table_pandas(con, t: str, out_csv: str, sep: str, chunksize: int, nrows: int = None):
+    sql = f"SELECT * FROM '{t}'"
+    if nrows is not None and nrows <= chunksize:
+        # tabella piccola: una sola SELECT, niente generatore chunked né producer
+        return _write_chunks(iter([pd.read_sql_query(sql, con)]), out_csv, sep)
+
+    # Producer/consumer con coda limitata: il fetch SQL del chunk successivo
+    # avviene mentre il thread principale scrive il CSV corrente (SQLite e
+    # to_csv rilasciano il GIL); maxsize=2 fa da backpressure.
+    q, err = queue.Queue(maxsize=2), []
+
+    def _producer():
+        try:
+            for chunk in pd.read_sql_query(sql, con, chunksize=chunksize):
+                q.put(chunk)
+        except Exception as e:
+            err.append(e)
+        finally:
+            q.put(None)
+
+    def _consume():
+        while (chunk := q.get()) is not None:
+            yield chunk
+
+    threading.Thread(target=_producer, daemon=True).start()
+    rows_total, digest = _write_chunks(_consume(), out_csv, sep)
+    if err: raise err[0]
+    return rows_total, digest
+
+def _export_table(con, db_path: str, t: str, out_csv: str, sep: str, chunksize: int, nrows: int = None):
+    # Prova gli engine veloci (C++/Rust) e ripiega su pandas se mancano o falliscono
+    engines = ["duckdb", "polars", "arrow", "cli"] if CSV_ENGINE == "auto" else [CSV_ENGINE]
+    for eng in engines:
+        try:
+            if eng == "duckdb": return _export_table_duckdb(db_path, t, out_csv, sep)
+            if eng == "polars": return _export_table_polars(con, t, out_csv, sep, chunksize)
+            if eng == "arrow":  return _export_table_arrow(con, t, out_csv, sep, chunksize)
+            if eng == "cli":    return _export_table_cli(con, db_path, t, out_csv, sep, nrows)
+        except Exception as e:
+            log(f"Engine '{eng}' non disponibile/fallito su {t} ({e}); fallback.")
+    return _export_table_pandas(con, t, out_csv, sep, chunksize, nrows)
+
+def _export_table_partitioned(db_path: str, t: str, out_csv: str, sep: str, chunksize: int, nrows: int):
+    # Lettori paralleli su range di rowid: un cursore per shard, riassemblaggio ordinato
+    con = _connect_ro(db_path)
+    try:
+        lo, hi = con.execute(f"SELECT MIN(rowid), MAX(rowid) FROM '{t}'").fetchone()
+    finally:
+        con.close()
+    nparts = min(os.cpu_count() or 1, (nrows + chunksize - 1) // chunksize)
+    if lo is None or nparts < 2:
+        raise ValueError("partizionamento per rowid non applicabile")
+    span = (hi - lo + nparts) // nparts
+    bounds = [(lo + i * span, min(hi, lo + (i + 1) * span - 1)) for i in range(nparts)]
+
+    def _part(i, a, b):
+        part_csv = f"{out_csv}.part{i}"
+        pcon = _connect_ro(db_path, check_same_thread=False)
+        try:
+            first, rows = (i == 0), 0  # header solo sul primo shard
+            with open(part_csv, "w", encoding="utf-8", newline="") as f:
+                for chunk in pd.read_sql_query(f"SELECT * FROM '{t}' WHERE rowid BETWEEN ? AND ?",
+                                               pcon, params=(a, b), chunksize=chunksize):
+                    rows += len(chunk)
+                    chunk.to_csv(f, index=False, sep=sep, header=first)
+                    first = False
+        finally:
+            pcon.close()
+        return part_csv, rows
+
+    with ThreadPoolExecutor(max_workers=nparts) as ex:
+        parts = list(ex.map(lambda ab: _part(ab[0], *ab[1]), list(enumerate(bounds))))
+
+    rows_total, h = 0, _new_hasher()
+    with open(out_csv, "wb") as outf:
+        w = _HashingWriter(outf, h)
+        for part_csv, rows in parts:
+            rows_total += rows
+            with open(part_csv, "rb") as pf:
+                shutil.copyfileobj(pf, w, 1 << 20)
+            os.remove(part_csv)
+    return rows_total, h.hexdigest()
+
+def _export_one(db_path: str, t: str, out_dir: str, sep: str, chunksize: int) -> dict:
+    # Corpo per-tabella eseguito nei worker: ogni processo apre la sua connessione read-only
+    out_csv = os.path.join(out_dir, f"{safe_name(t)}.csv")
+    _fadvise_path(db_path, "POSIX_FADV_SEQUENTIAL")  # scansione sequenziale: read-ahead aggressivo
+    con = _connect_ro(db_path, check_same_thread=False)
+    try:
+        n = con.execute(f"SELECT COUNT(*) FROM '{t}'").fetchone()[0]
+        if CSV_COMPRESSION == "zstd":
+            out_csv += ".zst"
+        if n == 0:
+            # tabella vuota: file toccato e basta, nessun engine/chunking da pagare
+            open(out_csv, "wb").close()
+            rows_total, digest = 0, None
+        elif CSV_COMPRESSION == "zstd":
+            # gli engine C++/Rust scrivono il file da sé: con compressione si passa
+            # sempre dal path pandas, che incapsula lo stream zstd
+            rows_total, digest = _export_table_pandas(con, t, out_csv, sep, chunksize, nrows=n)
+        elif n >= PARTITION_ROWS:
+            try:
+                rows_total, digest = _export_table_partitioned(db_path, t, out_csv, sep, chunksize, n)
+            except Exception as e:
+                log(f"Partizionamento non applicabile su {t} ({e}); export a cursore singolo.")
+                rows_total, digest = _export_table(con, db_path, t, out_csv, sep, chunksize, nrows=n)
+        else:
+            rows_total, digest = _export_table(con, db_path, t, out_csv, sep, chunksize, nrows=n)
+    finally:
+        con.close()
+    if digest is None:
+        digest = hash_file(out_csv)
+    # CSV write-once: inutile tenerne le pagine in cache a scapito del DB
+    _fadvise_path(out_csv, "POSIX_FADV_DONTNEED")
+    return {"table": t, "csv_path": out_csv, "rows": rows_total, "hash": digest}
+
 def export_all_tables_sqlite(db_path: str, out_dir: str, sep: str = ";", chunksize: int = 200_000):
-    exported = []
-    con = sqlite3.connect(db_path)
+    con = _connect_ro(db_path)
     try:
-        tables = pd.read_sql_query("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name", con)["name"].tolist()
-        if not tables: raise ValueError("Nessuna tabella trovata nel database.")
-        log(f"Trovate {len(tables)} tabelle. Esporto in CSV con chunksize={chunksize}...")
+        tables = [r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")]
+        page_size = con.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        con.close()
+    if not tables: raise ValueError("Nessuna tabella trovata nel database.")
+
+    max_workers = min(os.cpu_count() or 1, len(tables))
+    log(f"Trovate {len(tables)} tabelle (page_size={page_size}). Esporto in CSV con chunksize={chunksize}, workers={max_workers}...")
 
-        for t in tables:
-            out_csv = os.path.join(out_dir, f"{safe_name(t)}.csv")
-            first, rows_total = True, 0
+    # progresso per-tabella in NDJSON: osservabilità a metà run, memoria costante
+    ndjson_path = os.path.join(out_dir, "manifest.ndjson")
+    open(ndjson_path, "w").close()
+
+    exported = []
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        futures = {ex.submit(_export_one, db_path, t, out_dir, sep, chunksize): t for t in tables}
+        for fut in as_completed(futures):
+            t = futures[fut]
             try:
-                for chunk in pd.read_sql_query(f"SELECT * FROM '{t}'", con, chunksize=chunksize):
-                    rows_total += len(chunk)
-                    chunk.to_csv(out_csv, index=False, sep=sep, mode=("w" if first else "a"), header=first)
-                    first = False
-                info = {"table": t, "csv_path": out_csv, "rows": rows_total, "md5": md5sum(out_csv)}
+                info = fut.result()
                 exported.append(info)
-                log(f"✓ {t} -> {out_csv} (rows={rows_total}, md5={info['md5']})")
+                entry = {"table": info["table"], "filename": os.path.basename(info["csv_path"]),
+                         "rows": info["rows"], "hash": info["hash"]}
+                with open(ndjson_path, "a", encoding="utf-8") as nf:
+                    nf.write(_json_dumps(entry) + "\n")
+                log(f"✓ {t} -> {info['csv_path']} (rows={info['rows']})")
             except Exception as e:
                 log(f"⚠️ ERRORE su tabella {t}: {e}")
-    finally:
-        con.close()
+
+    exported.sort(key=lambda i: i["table"])
     return exported
 
 def write_manifest(out_dir: str, files_info: list):
+    # preferisce il progresso NDJSON scritto durante l'export; files_info resta
+    # il fallback per chiamate dirette senza export_all_tables_sqlite
+    ndjson_path = os.path.join(out_dir, "manifest.ndjson")
+    if os.path.exists(ndjson_path):
+        with open(ndjson_path, encoding="utf-8") as nf:
+            files = sorted((json.loads(line) for line in nf if line.strip()), key=lambda e: e["table"])
+    else:
+        files = [{"table": fi["table"], "filename": os.path.basename(fi["csv_path"]), "rows": fi["rows"], "hash": fi["hash"]} for fi in files_info]
     manifest = {
         "run_date_iso": datetime.now(timezone.utc).isoformat(),
-        "source": {"folder_id": SRC_FOLDER_ID, "file_id": SRC_FILE_ID, "target_filename": TARGET_FILENAME},
+        "source": {"folder_id": SRC_FOLDER_ID, "file_id": SRC_FILE_ID, "target_filename": TARGET_FILENAME, "hash": _SRC_HASH},
         "csv_separator": CSV_SEPARATOR,
-        "files": [{"table": fi["table"], "filename": os.path.basename(fi["csv_path"]), "rows": fi["rows"], "md5": fi["md5"]} for fi in files_info]
+        "hash_algo": HASH_ALGO,
+        "compression": CSV_COMPRESSION or None,
+        "files": files
     }
     mpath = os.path.join(out_dir, "manifest.json")
     with open(mpath, "w", encoding="utf-8") as f:
-        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        f.write(_json_dumps(manifest, indent=True))
     log(f"Manifest scritto: {mpath}")
     return mpath
 
 def main():
     # Log iniziali
-    now_it = datetime.now(ZoneInfo("Europe/Rome")).strftime("%Y-%m-%d %H:%M:%S %Z")
+    now_it = datetime.now(_ROME).strftime("%Y-%m-%d %H:%M:%S %Z")
     log(f"Start run — Europe/Rome now = {now_it}")
     log(f"WORKDIR={os.path.abspath(WORKDIR)}  OUTPUTDIR={os.path.abspath(OUTPUTDIR)}  DOWNLOADDIR={os.path.abspath(DOWNLOADDIR)}")
     log(f"GITHUB_EVENT_NAME={GITHUB_EVENT_NAME!r}  FORCE_RUN={FORCE_RUN}")
@@ -138,6 +477,7 @@ def main():
         log("Override orario attivo (run manuale o FORCE_RUN=1): procedo anche fuori finestra.")
 
     # Pulizia output
+    os.makedirs(OUTPUTDIR, exist_ok=True)
     if CLEAN_OUTPUT:
         clean_output_dir(OUTPUTDIR)
 